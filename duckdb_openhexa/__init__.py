@@ -6,17 +6,18 @@ standard duckdb:// connections, ensuring no interference between the two.
 """
 
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
 
 # Register duckdb_oh:// dialect with SQLAlchemy
-def _register_dialect():
+def register_dialect():
     """Register duckdb_oh as a custom SQLAlchemy dialect using our custom Dialect class."""
     try:
         from sqlalchemy.dialects import registry
         from duckdb_openhexa.engine import DuckDBPlusEngineSpec  # noqa: F401
-        
+
         # Register our custom dialect class (not the standard duckdb_engine.Dialect)
         # This ensures duckdb_oh:// uses DuckDBOpenHexaDialect while duckdb:// uses standard Dialect
         registry.register("duckdb_oh", "duckdb_openhexa.dialect", "DuckDBOpenHexaDialect")
@@ -24,4 +25,9 @@ def _register_dialect():
     except Exception as e:
         logger.error(f"Failed to register duckdb_oh dialect: {e}", exc_info=True)
 
-_register_dialect()
+
+# Registration is opt-out: set DUCKDB_OPENHEXA_AUTO_REGISTER=0 to import the
+# GraphQL client or UDFs without touching the SQLAlchemy dialect registry,
+# then call register_dialect() explicitly where needed.
+if os.getenv("DUCKDB_OPENHEXA_AUTO_REGISTER", "1") == "1":
+    register_dialect()
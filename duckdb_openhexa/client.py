@@ -3,57 +3,107 @@
 import logging
 import os
 import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 from typing import Any, Dict, List, Optional, Tuple
 
-from glom import glom
 from gql import Client, gql
 from gql.transport.exceptions import TransportQueryError
 from gql.transport.requests import RequestsHTTPTransport
+from requests.adapters import HTTPAdapter, Retry
 
 logger = logging.getLogger(__name__)
 
 # Global in-memory cache for download URLs
-# Cache stores tuples of (url, timestamp) for TTL enforcement
-_download_url_cache: Dict[str, Tuple[Optional[str], float]] = {}
+# Cache stores tuples of (url, timestamp) for TTL enforcement; ordered so
+# eviction is true LRU (hits move entries to the end, eviction pops the front)
+_download_url_cache: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+# Concurrent UDF workers read and evict from the cache; reorder/evict/insert
+# must be atomic or two threads can double-evict or grow past the cap
+_cache_lock = Lock()
 _CACHE_SIZE = int(os.getenv("OPENHEXA_CACHE_SIZE", "1000"))
 _CACHE_TTL_SECONDS = int(os.getenv("OPENHEXA_CACHE_GCS_TTL_MINUTES", "9")) * 60
 logger.info(
     f"Global download URL cache configured with max size {_CACHE_SIZE} and TTL {_CACHE_TTL_SECONDS}s"
 )
 
+# Global in-memory cache for dataset listings, keyed by workspace filter
+# Mirrors _download_url_cache: tuples of (records, timestamp) for TTL enforcement,
+# with its own lock so concurrent callers cannot double-delete an expired entry
+_datasets_cache: Dict[Optional[str], Tuple[List[Dict[str, str]], float]] = {}
+_datasets_cache_lock = Lock()
+_DATASETS_TTL_SECONDS = int(os.getenv("OPENHEXA_DATASETS_TTL_SECONDS", "60"))
+_DATASETS_PER_PAGE = int(os.getenv("OPENHEXA_DATASETS_PER_PAGE", "200"))
+
+# Optional cross-process cache layer: under gunicorn/celery each worker keeps
+# its own in-memory cache, multiplying GraphQL load N-fold for the same signed
+# URLs. When OPENHEXA_CACHE_DIR is set (and diskcache is installed), fetched
+# URLs are also written to disk with the same TTL so all workers share them.
+_MISSING = object()
+_disk_cache = None
+_DISK_CACHE_DIR = os.getenv("OPENHEXA_CACHE_DIR")
+if _DISK_CACHE_DIR:
+    try:
+        from diskcache import Cache as _DiskCache
+
+        _disk_cache = _DiskCache(_DISK_CACHE_DIR, eviction_policy="least-recently-used")
+        logger.info("Cross-process download URL cache enabled at %s", _DISK_CACHE_DIR)
+    except ImportError:
+        logger.warning(
+            "OPENHEXA_CACHE_DIR is set but diskcache is not installed - "
+            "falling back to the in-memory cache only"
+        )
 
-class OpenHexaGraphQLClient:
-    """Client for querying OpenHexa GraphQL API with authentication."""
-
-    def __init__(self, url: Optional[str] = None):
-        """Initialize the GraphQL client with optional URL."""
-        self.url = url or os.getenv("OPENHEXA_GRAPHQL_URL", "https://app.openhexa.org/graphql/")
-        self.api_token = os.getenv("OPENHEXA_API_TOKEN")
-
-        if not self.api_token:
-            logger.warning("OPENHEXA_API_TOKEN not set - queries may fail")
+# Shared thread pool for fetching several download URLs concurrently.
+# The UDF receives a whole DuckDB vector (up to 2048 rows) at a time, so
+# overlapping the GraphQL round-trips turns N sequential RTTs into N/concurrency.
+_MAX_CONCURRENT_URL_REQUESTS = int(os.getenv("OPENHEXA_MAX_CONCURRENT_URL_REQUESTS", "16"))
+_url_executor = ThreadPoolExecutor(
+    max_workers=_MAX_CONCURRENT_URL_REQUESTS, thread_name_prefix="openhexa-url"
+)
 
-    def _get_transport(self) -> RequestsHTTPTransport:
-        """Create a transport with authentication headers."""
-        headers = {}
-        if self.api_token:
-            headers["Authorization"] = f"Bearer {self.api_token}"
 
-        transport = RequestsHTTPTransport(
-            url=self.url,
-            headers=headers,
-            verify=True,
-            retries=3,
-            timeout=30,
+class _PooledRequestsHTTPTransport(RequestsHTTPTransport):
+    """RequestsHTTPTransport whose connection pool matches the URL thread pool.
+
+    The default urllib3 pool holds 10 connections; with more concurrent workers
+    the extra requests would open and discard a fresh TLS connection each time.
+    """
+
+    def connect(self):
+        super().connect()
+        # Same retry policy the stock transport mounts, built from its own
+        # attributes so 429 stays retryable on gql 4 (the getattr defaults
+        # cover gql 3, which hardcodes these values): allowed_methods=None
+        # retries POSTs too - GraphQL is all POST, and an int max_retries
+        # would exclude them
+        retries = Retry(
+            total=self.retries,
+            backoff_factor=getattr(self, "retry_backoff_factor", 0.1),
+            status_forcelist=getattr(
+                self, "retry_status_forcelist", [429, 500, 502, 503, 504]
+            ),
+            allowed_methods=None,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=_MAX_CONCURRENT_URL_REQUESTS,
+            pool_maxsize=_MAX_CONCURRENT_URL_REQUESTS,
+            max_retries=retries,
         )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
-        return transport
 
-    def query_datasets(self, workspace: Optional[str] = None) -> List[Dict[str, str]]:
-        """Query datasets from OpenHexa, optionally filtered by workspace (NOT cached - always fresh)."""
-        query_string = """
-        query GetDatasets($query: String!, $perPage: Int!) {
-            datasets(query: $query, perPage: $perPage) {
+class OpenHexaGraphQLClient:
+    """Client for querying OpenHexa GraphQL API with authentication."""
+
+    # Pre-compiled GraphQL documents (parsed once at import, reused for every call)
+    _DATASETS_QUERY = gql(
+        """
+        query GetDatasets($query: String!, $page: Int!, $perPage: Int!) {
+            datasets(query: $query, page: $page, perPage: $perPage) {
                 totalPages
                 items {
                     id
@@ -77,19 +127,135 @@ class OpenHexaGraphQLClient:
             }
         }
         """
+    )
 
-        try:
-            transport = self._get_transport()
-            client = Client(transport=transport, fetch_schema_from_transport=False)
+    # Single document for both the "latest" and pinned-version cases, selected
+    # server-side via @include/@skip, so no per-call GraphQL parsing is needed
+    _FILE_URL_QUERY = gql(
+        """
+        query GetFileDownloadUrl(
+            $workspaceSlug: String!
+            $datasetSlug: String!
+            $filename: String!
+            $versionId: ID = ""
+            $latest: Boolean!
+        ) {
+            datasetLinkBySlug(workspaceSlug: $workspaceSlug, datasetSlug: $datasetSlug) {
+                dataset {
+                    latestVersion @include(if: $latest) {
+                        fileByName(name: $filename) {
+                            downloadUrl(attachment: false)
+                        }
+                    }
+                    version(id: $versionId) @skip(if: $latest) {
+                        fileByName(name: $filename) {
+                            downloadUrl(attachment: false)
+                        }
+                    }
+                }
+            }
+        }
+        """
+    )
+
+    def __init__(self, url: Optional[str] = None):
+        """Initialize the GraphQL client with optional URL."""
+        self.url = url or os.getenv("OPENHEXA_GRAPHQL_URL", "https://app.openhexa.org/graphql/")
+        self.api_token = os.getenv("OPENHEXA_API_TOKEN")
+
+        if not self.api_token:
+            logger.warning("OPENHEXA_API_TOKEN not set - queries may fail")
+
+        # One connected gql session per thread. The sync transport cannot serve
+        # concurrent execute() calls (connect() raises TransportAlreadyConnected
+        # while another thread's call is in flight), and Client.execute tears the
+        # session down after every query. connect_sync() keeps each thread's
+        # requests.Session open instead, so its keep-alive TCP/TLS connection
+        # survives across calls. Threads are bounded by the URL executor, so at
+        # most a handful of sessions exist per process.
+        self._local = threading.local()
+
+    def _get_session(self):
+        """Return this thread's connected gql session, creating it on first use."""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            client = Client(transport=self._get_transport(), fetch_schema_from_transport=False)
+            session = client.connect_sync()
+            self._local.session = session
+        return session
+
+    def _get_transport(self) -> RequestsHTTPTransport:
+        """Create a transport with authentication headers."""
+        headers = {}
+        if self.api_token:
+            headers["Authorization"] = f"Bearer {self.api_token}"
+
+        transport = _PooledRequestsHTTPTransport(
+            url=self.url,
+            headers=headers,
+            verify=True,
+            retries=3,
+            timeout=30,
+        )
+
+        return transport
+
+    def query_datasets(self, workspace: Optional[str] = None) -> List[Dict[str, str]]:
+        """Query datasets from OpenHexa, optionally filtered by workspace (cached with TTL).
+
+        Listings are cached in global memory per workspace filter and expire after
+        OPENHEXA_DATASETS_TTL_SECONDS (default: 60s), collapsing repeated workbench
+        queries into a single GraphQL round-trip.
+        """
+        # Check global cache first and verify TTL
+        with _datasets_cache_lock:
+            if workspace in _datasets_cache:
+                cached_records, cached_time = _datasets_cache[workspace]
+                age_seconds = time.time() - cached_time
+
+                if age_seconds < _DATASETS_TTL_SECONDS:
+                    logger.debug(
+                        "Datasets CACHE HIT for workspace=%s (age: %.1fs)", workspace, age_seconds
+                    )
+                    return cached_records
+                else:
+                    # Cache entry expired
+                    del _datasets_cache[workspace]
 
-            query = gql(query_string)
-            result = client.execute(query, variable_values={"query": "", "perPage": 1000})
+        try:
+            # Narrow the result server-side by searching on the workspace slug.
+            # The search is fuzzy, so the exact match in _flatten_datasets stays
+            # as the authoritative filter; this just shrinks the payload.
+            # Page through the results instead of requesting one oversized page.
+            records: List[Dict[str, str]] = []
+            page = 1
+            while True:
+                result = self._get_session().execute(
+                    self._DATASETS_QUERY,
+                    variable_values={
+                        "query": workspace or "",
+                        "page": page,
+                        "perPage": _DATASETS_PER_PAGE,
+                    },
+                )
+                records.extend(self._flatten_datasets(result, workspace))
 
-            records = self._flatten_datasets(result, workspace)
+                total_pages = result.get("datasets", {}).get("totalPages") or 1
+                if page >= total_pages:
+                    break
+                page += 1
             logger.info(
                 f"Retrieved {len(records)} dataset files"
                 + (f" from workspace '{workspace}'" if workspace else "")
             )
+
+            # Store in global cache with current timestamp (same eviction as the URL cache)
+            with _datasets_cache_lock:
+                if len(_datasets_cache) >= _CACHE_SIZE:
+                    oldest_key = next(iter(_datasets_cache))
+                    del _datasets_cache[oldest_key]
+
+                _datasets_cache[workspace] = (records, time.time())
             return records
 
         except TransportQueryError as e:
@@ -121,14 +287,18 @@ class OpenHexaGraphQLClient:
                 version_name = version.get("name", "")
                 files = version.get("files", {}).get("items", [])
 
+                # Invariant across all files of a version: build the prefix once
+                path_prefix = f"{workspace_slug}/{dataset_slug}/{version_name}/"
+
                 for file_item in files:
+                    filename = file_item.get("filename", "")
                     records.append(
                         {
                             "workspace": workspace_slug,
                             "dataset": dataset_slug,
                             "version": version_name,
-                            "filename": file_item.get("filename", ""),
-                            "file_path": f"{workspace_slug}/{dataset_slug}/{version_name}/{file_item.get('filename', '')}",
+                            "filename": filename,
+                            "file_path": path_prefix + filename,
                         }
                     )
 
@@ -143,78 +313,102 @@ class OpenHexaGraphQLClient:
         Cache size can be configured via OPENHEXA_CACHE_SIZE env var (default: 1000).
         """
         # Check global cache first and verify TTL
-        if file_path in _download_url_cache:
-            cached_url, cached_time = _download_url_cache[file_path]
-            age_seconds = time.time() - cached_time
-
-            if age_seconds < _CACHE_TTL_SECONDS:
-                logger.info(
-                    f"CACHE HIT for {file_path} (age: {age_seconds:.1f}s, cache size: {len(_download_url_cache)})"
-                )
-                return cached_url
-            else:
-                # Cache entry expired
-                logger.info(
-                    f"CACHE EXPIRED for {file_path} (age: {age_seconds:.1f}s > TTL: {_CACHE_TTL_SECONDS}s)"
-                )
-                del _download_url_cache[file_path]
+        with _cache_lock:
+            if file_path in _download_url_cache:
+                cached_url, cached_time = _download_url_cache[file_path]
+                age_seconds = time.time() - cached_time
+
+                if age_seconds < _CACHE_TTL_SECONDS:
+                    _download_url_cache.move_to_end(file_path)
+                    # Lazy %-formatting: the hit path runs per row, only format when enabled
+                    logger.debug(
+                        "CACHE HIT for %s (age: %.1fs, cache size: %d)",
+                        file_path,
+                        age_seconds,
+                        len(_download_url_cache),
+                    )
+                    return cached_url
+                else:
+                    # Cache entry expired
+                    logger.debug(
+                        "CACHE EXPIRED for %s (age: %.1fs > TTL: %ds)",
+                        file_path,
+                        age_seconds,
+                        _CACHE_TTL_SECONDS,
+                    )
+                    del _download_url_cache[file_path]
 
         # Parse file path: workspace/dataset/version/filename
-        parts = file_path.split("/")
+        # maxsplit=3 keeps any extra slashes in the filename part, no rejoin needed
+        parts = file_path.split("/", 3)
         if len(parts) < 4:
             raise ValueError(
                 f"Invalid file path format. Expected 'workspace/dataset/version/filename', got '{file_path}' "
                 f"(only {len(parts)} parts found)"
             )
-        workspace_slug, dataset_slug, version, filename = parts[0], parts[1], parts[2], "/".join(parts[3:])
-
-        query_string = """
-        query GetFileDownloadUrl($workspaceSlug: String!, $datasetSlug: String!, $filename: String!) {{
-            datasetLinkBySlug(workspaceSlug: $workspaceSlug, datasetSlug: $datasetSlug) {{
-                dataset {{
-                    {version_query} {{
-                        fileByName(name: $filename) {{
-                            downloadUrl(attachment: false)
-                        }}
-                    }}
-                }}
-            }}
-        }}
-        """.format(
-            version_query="latestVersion" if version == "latest" else f'version(id: "{version}")'
-        )
+        workspace_slug, dataset_slug, version, filename = parts
+
+        # Second-level cache shared across worker processes (TTL handled by diskcache).
+        # Entries carry their original fetch timestamp: promoting a hit into the
+        # memory cache with that timestamp (not now) keeps the signed URL's real
+        # age, so it cannot outlive the GCS signature via cache hand-offs.
+        if _disk_cache is not None:
+            entry = _disk_cache.get(file_path, default=_MISSING)
+            if entry is not _MISSING:
+                cached_url, fetched_at = entry
+                logger.debug("DISK CACHE HIT for %s", file_path)
+                with _cache_lock:
+                    # Same cap check as the fetch path: warming up from another
+                    # worker's disk entries must not grow the cache unbounded
+                    if len(_download_url_cache) >= _CACHE_SIZE:
+                        _download_url_cache.popitem(last=False)
+                    _download_url_cache[file_path] = (cached_url, fetched_at)
+                return cached_url
 
-        try:
-            transport = self._get_transport()
-            client = Client(transport=transport, fetch_schema_from_transport=False)
+        latest = version == "latest"
 
-            query = gql(query_string)
-            result = client.execute(
-                query,
+        try:
+            # Reuse this thread's connected session so HTTP keep-alive is preserved
+            result = self._get_session().execute(
+                self._FILE_URL_QUERY,
                 variable_values={
                     "workspaceSlug": workspace_slug,
                     "datasetSlug": dataset_slug,
                     "filename": filename,
+                    "versionId": version,
+                    "latest": latest,
                 },
             )
 
-            logger.info(f"Fetched download URL from API for {file_path}")
+            logger.debug("Fetched download URL from API for %s", file_path)
+
+            version_key = "latestVersion" if latest else "version"
+
+            # Direct dict walk; any missing/null level along the path means no URL
+            try:
+                download_url = result["datasetLinkBySlug"]["dataset"][version_key]["fileByName"][
+                    "downloadUrl"
+                ]
+            except (KeyError, TypeError):
+                download_url = None
 
-            version_key = "latestVersion" if version == "latest" else "version"
-            path = f"datasetLinkBySlug.dataset.{version_key}.fileByName.downloadUrl"
+            # Store in global cache with current timestamp (evict least-recently-used when full)
+            fetched_at = time.time()
+            with _cache_lock:
+                if len(_download_url_cache) >= _CACHE_SIZE:
+                    oldest_key, _ = _download_url_cache.popitem(last=False)
+                    logger.debug("Cache full, evicted %s", oldest_key)
 
-            download_url = glom(result, path, default=None)
+                _download_url_cache[file_path] = (download_url, fetched_at)
 
-            # Store in global cache with current timestamp (simple LRU: remove oldest if cache is full)
-            if len(_download_url_cache) >= _CACHE_SIZE:
-                # Remove first (oldest) item
-                oldest_key = next(iter(_download_url_cache))
-                del _download_url_cache[oldest_key]
-                logger.debug(f"Cache full, evicted {oldest_key}")
+            if _disk_cache is not None:
+                _disk_cache.set(file_path, (download_url, fetched_at), expire=_CACHE_TTL_SECONDS)
 
-            _download_url_cache[file_path] = (download_url, time.time())
             logger.info(
-                f"Fetched and cached download URL for {file_path} (cache size: {len(_download_url_cache)}, TTL: {_CACHE_TTL_SECONDS}s)"
+                "Fetched and cached download URL for %s (cache size: %d, TTL: %ds)",
+                file_path,
+                len(_download_url_cache),
+                _CACHE_TTL_SECONDS,
             )
 
             return download_url
@@ -227,3 +421,37 @@ class OpenHexaGraphQLClient:
         except Exception as e:
             logger.error(f"Unexpected error querying file path {file_path}: {e}", exc_info=True)
             return None
+
+    def query_file_download_urls(self, file_paths: List[str]) -> List[Optional[str]]:
+        """Query download URLs for several file paths, overlapping the GraphQL round-trips.
+
+        Cached paths are resolved inline without touching the thread pool; only the
+        misses are dispatched to the executor and hit the network. Results are
+        returned in the same order as the input.
+        """
+        urls: List[Optional[str]] = [None] * len(file_paths)
+        now = time.time()
+
+        # Split cached vs uncached upfront so a fully-warm batch costs dict lookups only
+        missing: List[Tuple[int, str]] = []
+        with _cache_lock:
+            for index, path in enumerate(file_paths):
+                entry = _download_url_cache.get(path)
+                if entry is not None and now - entry[1] < _CACHE_TTL_SECONDS:
+                    _download_url_cache.move_to_end(path)
+                    urls[index] = entry[0]
+                else:
+                    missing.append((index, path))
+
+        if missing:
+            if len(missing) == 1:
+                index, path = missing[0]
+                urls[index] = self.query_file_download_url(path)
+            else:
+                fetched = _url_executor.map(
+                    self.query_file_download_url, [path for _, path in missing]
+                )
+                for (index, _), url in zip(missing, fetched):
+                    urls[index] = url
+
+        return urls
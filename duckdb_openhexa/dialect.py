@@ -6,18 +6,115 @@ This dialect is exclusively for duckdb_oh:// URIs and does not affect standard d
 import logging
 import os
 import time
-from threading import Lock
-from typing import Dict, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from threading import Lock, Thread
+from typing import Optional, Tuple
 
 import duckdb
 from duckdb_engine import Dialect, ConnectionWrapper, get_core_config, apply_config
 
+from duckdb_openhexa.functions import get_dataset_file_url_batch
+
 logger = logging.getLogger(__name__)
 
+# Flask is optional: outside a Superset/Flask context the pool keys on "default".
+# Imported once here instead of per connect() call.
+try:
+    from flask import g as _flask_g
+except ImportError:
+    _flask_g = None
+
+# Core config keys are static for the loaded duckdb_engine version, so
+# resolve them once instead of re-introspecting on every connect
+_CORE_KEYS = frozenset(get_core_config())
+
+# One-shot setup for new pooled connections: HTTP caching plus the extensions
+# needed for remote parquet access, in a single parse/dispatch round-trip
+# (INSTALL is a no-op re-parse once the extension is cached on disk)
+_INIT_SQL = (
+    "SET http_keep_alive=true; "
+    "SET enable_http_metadata_cache=true; "
+    "INSTALL httpfs; LOAD httpfs; "
+    "INSTALL parquet; LOAD parquet;"
+)
+
 # Connection TTL configuration
 _CONNECTION_TTL_SECONDS = int(os.getenv("DUCKDB_OH_CONNECTION_TTL_MINUTES", "60")) * 60
 logger.info(f"Connection TTL set to {_CONNECTION_TTL_SECONDS}s ({_CONNECTION_TTL_SECONDS/60:.0f}min)")
 
+# Cap on pooled connections: each one holds its own DuckDB memory arena and
+# HTTP cache, so an unbounded per-user pool grows until OOM on long-running
+# Superset instances
+_MAX_POOL_SIZE = int(os.getenv("DUCKDB_OH_MAX_POOL", "256"))
+
+# Closing a DuckDB handle can flush write buffers and block; evicted
+# connections are closed on this single background thread so the query that
+# noticed the expiry never waits on the close
+_close_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="duckdb-oh-close")
+
+
+def _close_quietly(conn: duckdb.DuckDBPyConnection) -> None:
+    """Close a connection, ignoring errors from already-dead handles."""
+    with suppress(Exception):
+        conn.close()
+
+
+class _PoolHolder:
+    """Per-key pool slot with its own lock.
+
+    Creating a DuckDB connection (connect + extension installs + UDF
+    registration) can take seconds; giving each (user, database) key its own
+    lock lets cold connects for different users proceed in parallel instead
+    of serializing on one pool-wide mutex.
+    """
+
+    __slots__ = (
+        "lock",
+        "conn",
+        "created_at",
+        "expires_at",
+        "loaded_extensions",
+        "registered_filesystems",
+        "applied_config",
+    )
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.conn: Optional[duckdb.DuckDBPyConnection] = None
+        self.created_at = 0.0
+        # Precomputed deadline so the checkout hot path is a single compare
+        # instead of recomputing now - created_at > TTL on every hit
+        self.expires_at = 0.0
+        # Setup already applied to this connection, so repeat checkouts with
+        # the same engine config skip the LOAD/register/apply work entirely
+        self.loaded_extensions: set = set()
+        self.registered_filesystems: set = set()
+        self.applied_config: Optional[dict] = None
+
+
+class PooledConnectionWrapper(ConnectionWrapper):
+    """Thin wrapper around a per-checkout cursor of the pooled connection.
+
+    Defined at module scope so each checkout reuses one class object instead
+    of rebuilding the class (and its MRO) inside connect().
+    """
+
+    def __init__(self, c: duckdb.DuckDBPyConnection, key: Tuple[str, str]):
+        super().__init__(c)
+        # Keep our own reference to the cursor: the parent stores it under a
+        # name-mangled private attribute, so reaching for it from here would
+        # fall into __getattr__ and delegate to the raw DuckDB connection
+        self._cursor = c
+        self._pool_key = key
+
+    def close(self) -> None:
+        """Close only this checkout's cursor; the root connection stays pooled."""
+        self.closed = True
+        _close_quietly(self._cursor)
+        logger.debug("Released pooled cursor (user=%s)", self._pool_key[0])
+
 
 class DuckDBOpenHexaDialect(Dialect):
     """
@@ -31,66 +128,105 @@ class DuckDBOpenHexaDialect(Dialect):
     Only affects duckdb_oh:// connections, leaving standard duckdb:// unmodified.
     """
     
-    # Class-level connection pool: (user_id, database_path) -> (connection, timestamp)
-    _connection_pool: Dict[Tuple[str, str], Tuple[duckdb.DuckDBPyConnection, float]] = {}
+    # Class-level connection pool: (user_id, database_path) -> _PoolHolder
+    # _pool_lock only guards holder insertion/eviction; connection creation
+    # happens under the holder's own lock so distinct keys never block each
+    # other. Ordered so the size cap evicts the oldest key first.
+    _connection_pool: "OrderedDict[Tuple[str, str], _PoolHolder]" = OrderedDict()
     _pool_lock = Lock()
     
     @classmethod
-    def _get_or_create_connection(cls, user_id: str, database_path: str) -> duckdb.DuckDBPyConnection:
+    def _get_or_create_connection(
+        cls, user_id: str, database_path: str
+    ) -> Tuple[duckdb.DuckDBPyConnection, _PoolHolder]:
         """Get or create a persistent per-user DuckDB connection from the pool.
-        
+
         Args:
             user_id: User identifier (username or "default")
             database_path: Path to database file
-            
+
         Returns:
-            Persistent DuckDB connection with UDFs registered
+            Persistent DuckDB connection with UDFs registered, and its pool
+            holder tracking what setup was already applied to it
         """
         cache_key = (user_id, database_path)
-        
-        with cls._pool_lock:
-            # Check if we have a connection for this user+database
-            if cache_key in cls._connection_pool:
-                conn, created_at = cls._connection_pool[cache_key]
-                age_seconds = time.time() - created_at
-                
-                # Check if connection has expired
-                if age_seconds > _CONNECTION_TTL_SECONDS:
-                    logger.info(f"Connection expired for user={user_id} (age: {age_seconds:.1f}s > TTL: {_CONNECTION_TTL_SECONDS}s), recreating")
-                    try:
-                        conn.close()
-                    except Exception:
-                        pass
-                    del cls._connection_pool[cache_key]
-                else:
-                    try:
-                        # Verify connection is still alive
-                        conn.execute("SELECT 1")
-                        logger.debug(f"Reusing pooled connection for user={user_id}, db={database_path} (age: {age_seconds:.1f}s)")
-                        return conn
-                    except Exception as e:
-                        logger.warning(f"Pooled connection dead, removing: {e}")
-                        del cls._connection_pool[cache_key]
-            
+
+        # Lock-free fast path: CPython dict reads are GIL-atomic, so a pool hit
+        # costs one lookup plus a TTL compare without serializing other callers
+        holder = cls._connection_pool.get(cache_key)
+        if holder is None:
+            # Only holder insertion/eviction needs the pool-wide lock; it is cheap
+            with cls._pool_lock:
+                holder = cls._connection_pool.get(cache_key)
+                if holder is None:
+                    # Enforce the pool cap before admitting a new key; evict the
+                    # oldest-inserted entry and close its connection off-thread
+                    while len(cls._connection_pool) >= _MAX_POOL_SIZE:
+                        evicted_key, evicted = cls._connection_pool.popitem(last=False)
+                        with evicted.lock:
+                            if evicted.conn is not None:
+                                _close_executor.submit(_close_quietly, evicted.conn)
+                                evicted.conn = None
+                        logger.info(
+                            "Pool full, evicted connection for user=%s, db=%s",
+                            evicted_key[0],
+                            evicted_key[1],
+                        )
+                    holder = cls._connection_pool[cache_key] = _PoolHolder()
+
+        conn = holder.conn
+        if conn is not None and time.time() < holder.expires_at:
+            # DuckDB is in-process: the connection cannot drop the way a
+            # network DB can, so no liveness ping is needed on checkout.
+            # TTL expiry handles recycling instead.
+            logger.debug("Reusing pooled connection for user=%s, db=%s", user_id, database_path)
+            return conn, holder
+
+        # Miss or expired: only callers racing on this *key* serialize here,
+        # so a slow cold connect for one user never blocks other users
+        with holder.lock:
+            # Double-check: another thread may have (re)created the connection meanwhile
+            conn = holder.conn
+            if conn is not None:
+                if time.time() < holder.expires_at:
+                    return conn, holder
+                age_seconds = time.time() - holder.created_at
+
+                logger.info(
+                    "Connection expired for user=%s (age: %.1fs > TTL: %ds), recreating",
+                    user_id,
+                    age_seconds,
+                    _CONNECTION_TTL_SECONDS,
+                )
+                # Close asynchronously so the caller's query is not stalled
+                _close_executor.submit(_close_quietly, conn)
+                holder.conn = None
+
             # Create new connection
-            logger.info(f"Creating new pooled connection for user={user_id}, db={database_path}")
+            logger.info("Creating new pooled connection for user=%s, db=%s", user_id, database_path)
             conn = duckdb.connect(database_path)
-            
-            # Configure HTTP caching for optimal performance
-            conn.execute("SET http_keep_alive=true")
-            conn.execute("SET enable_http_metadata_cache=true")
-            
-            # Install required extensions
-            conn.execute("INSTALL httpfs; LOAD httpfs;")
-            conn.execute("INSTALL parquet; LOAD parquet;")
-            
+
+            # Configure HTTP caching and install required extensions in one shot
+            conn.execute(_INIT_SQL)
+
             # Register UDFs
             cls._register_udfs(conn)
-            
-            logger.info(f"Configured HTTP caching, extensions, and UDFs for pooled connection")
-            
-            cls._connection_pool[cache_key] = (conn, time.time())
-            return conn
+
+            logger.info("Configured HTTP caching, extensions, and UDFs for pooled connection")
+
+            # Fresh connection: forget what was applied to its predecessor
+            holder.loaded_extensions.clear()
+            holder.registered_filesystems.clear()
+            holder.applied_config = None
+
+            # Publish the timestamps before the connection: fields are read
+            # lock-free on the fast path, and this ordering guarantees a reader
+            # never sees a fresh conn paired with a stale (expired) deadline -
+            # at worst it sees conn=None and falls through to the locked path
+            holder.created_at = time.time()
+            holder.expires_at = holder.created_at + _CONNECTION_TTL_SECONDS
+            holder.conn = conn
+            return conn, holder
     
     @staticmethod
     def _register_udfs(conn: duckdb.DuckDBPyConnection) -> None:
@@ -100,20 +236,30 @@ class DuckDBOpenHexaDialect(Dialect):
             conn: DuckDB connection to register UDFs on
         """
         try:
-            from duckdb_openhexa.functions import get_dataset_file_url, openhexa_dataset_files
-            
-            # Register scalar function with SPECIAL null_handling to allow NULL returns
+            # Register as an Arrow UDF so DuckDB passes whole vectors (one Python
+            # call per chunk instead of per row) and the batch can fan out its
+            # GraphQL requests concurrently. SPECIAL null_handling allows NULL returns.
             conn.create_function(
                 "get_dataset_file_url",
-                get_dataset_file_url,
+                get_dataset_file_url_batch,
+                ["VARCHAR"],
+                "VARCHAR",
+                type="arrow",
                 side_effects=True,
                 null_handling="special",
             )
             
-            # Note: openhexa_dataset_files is a table function that needs special handling
-            # It's registered via execute-time interception if needed
-            
+            # Note: DuckDB's Python API has no table-valued UDFs, so
+            # openhexa_dataset_files stays a plain Python function; callers can
+            # register its DataFrame with conn.register(). No query interception
+            # is involved, so unrelated queries hit the native execute path.
+
             logger.debug("Registered UDFs on connection")
+        except duckdb.NotImplementedException:
+            # Duplicate create_function raises NotImplementedException ("A
+            # function by the name of ... is already created"); harmless when a
+            # pooled connection is re-validated, keep the existing registration
+            logger.debug("UDFs already registered on connection")
         except Exception as e:
             logger.error(f"Failed to register UDFs: {e}", exc_info=True)
     
@@ -131,66 +277,108 @@ class DuckDBOpenHexaDialect(Dialect):
         elif "database" in cparams:
             database_path = cparams["database"]
         
-        logger.debug(f"DuckDBOpenHexaDialect.connect called with database_path={database_path}")
+        logger.debug("DuckDBOpenHexaDialect.connect called with database_path=%s", database_path)
         
         # If we have a database path (not :memory:), use our pool
         if database_path and database_path != ":memory:":
-            # Get user_id from Flask context (only once per connection request)
+            # Get user_id from Flask context, resolved once per request: the
+            # first checkout stores it on g so later checkouts in the same
+            # request skip the g.user attribute walk
             user_id = "default"
-            try:
-                from flask import g
-                if hasattr(g, 'user') and g.user:
-                    user_id = g.user.username
-            except Exception:
-                pass
+            if _flask_g is not None:
+                try:
+                    cached_user_id = getattr(_flask_g, "_duckdb_oh_user_id", None)
+                    if cached_user_id is not None:
+                        user_id = cached_user_id
+                    else:
+                        user = getattr(_flask_g, "user", None)
+                        if user:
+                            user_id = user.username
+                            # Only memoize a resolved user: g.user can still be
+                            # unset early in a request (e.g. during auth), and
+                            # caching "default" would pin every later checkout
+                            # in the request to the shared pool
+                            _flask_g._duckdb_oh_user_id = user_id
+                except Exception:
+                    # Outside an application context g raises; fall back to default
+                    pass
             
-            logger.info(f"Using per-user connection pool for user={user_id}, db={database_path}")
+            # Per-checkout line: DEBUG with lazy args so it costs nothing when filtered
+            logger.debug("Using per-user connection pool for user=%s, db=%s", user_id, database_path)
             
             # Process config like original Dialect does
-            core_keys = get_core_config()
             preload_extensions = cparams.pop("preload_extensions", [])
             config = dict(cparams.get("config", {}))
             cparams["config"] = config
             config.update(cparams.pop("url_config", {}))
-            
+
             # Extract ext config (non-core keys)
-            ext = {k: config.pop(k) for k in list(config) if k not in core_keys}
+            ext = {k: config.pop(k) for k in list(config) if k not in _CORE_KEYS}
             
             # Get pooled connection (efficient - lock only on miss)
-            pooled_conn = self._get_or_create_connection(user_id, database_path)
-            
-            # Apply any extensions/filesystems that were requested
+            pooled_conn, holder = self._get_or_create_connection(user_id, database_path)
+
+            # Apply only the extensions/filesystems/config this connection has
+            # not seen yet; on repeat checkouts with identical engine config
+            # the whole block is a set-membership no-op
             for extension in preload_extensions:
-                pooled_conn.execute(f"LOAD {extension}")
-            
+                if extension not in holder.loaded_extensions:
+                    pooled_conn.execute(f"LOAD {extension}")
+                    holder.loaded_extensions.add(extension)
+
             filesystems = cparams.pop("register_filesystems", [])
             for filesystem in filesystems:
-                pooled_conn.register_filesystem(filesystem)
-            
-            # Apply config like original Dialect does
-            apply_config(self, pooled_conn, ext)
+                fs_name = getattr(filesystem, "protocol", None) or repr(filesystem)
+                if fs_name not in holder.registered_filesystems:
+                    pooled_conn.register_filesystem(filesystem)
+                    holder.registered_filesystems.add(fs_name)
+
+            # Apply config like original Dialect does, but only when it changed
+            if ext and ext != holder.applied_config:
+                apply_config(self, pooled_conn, ext)
+                holder.applied_config = ext
             
             # Create pool key for wrapper
             pool_key = (user_id, database_path)
             
-            # Create a thin wrapper that prevents connection from being closed
-            # This is much faster than using __getattr__ delegation
-            class PooledConnectionWrapper(ConnectionWrapper):
-                """Thin wrapper that only overrides close() - no __getattr__ overhead."""
-                def __init__(self, c: duckdb.DuckDBPyConnection, key: Tuple[str, str]):
-                    super().__init__(c)
-                    self._pool_key = key
-                
-                def close(self) -> None:
-                    """Don't actually close pooled connections, just mark as closed."""
-                    self.closed = True
-                    # Connection stays alive in pool for reuse
-                    logger.debug(f"ConnectionWrapper.close() called but connection kept alive (user={self._pool_key[0]})")
-            
-            # Return thin wrapper that prevents real closure
-            return PooledConnectionWrapper(pooled_conn, pool_key)
+            # Hand each SQLAlchemy session its own cursor off the pooled root
+            # connection. DuckDB serializes queries on a single connection, so
+            # sharing the root directly would make a user's concurrent dashboard
+            # panels run one at a time; cursors are cheap, share the parent's
+            # catalog (UDFs) and HTTP/parquet caches, and can run in parallel.
+            return PooledConnectionWrapper(pooled_conn.cursor(), pool_key)
         
         # For in-memory or unknown cases, use parent's connect method
         logger.debug("Using parent Dialect.connect method (in-memory or unknown path)")
         return super().connect(*cargs, **cparams)
 
+
+# Proactive eviction: a daemon thread sweeps expired connections so their
+# close() never runs on (and stalls) a user's query thread
+_SWEEP_INTERVAL_SECONDS = min(_CONNECTION_TTL_SECONDS / 4, 60)
+
+
+def _sweep_expired_connections() -> None:
+    """Periodically evict expired pooled connections in the background."""
+    while True:
+        time.sleep(_SWEEP_INTERVAL_SECONDS)
+        now = time.time()
+        for key, holder in list(DuckDBOpenHexaDialect._connection_pool.items()):
+            if holder.conn is None or now < holder.expires_at:
+                continue
+            with holder.lock:
+                conn = holder.conn
+                # Re-check under the lock: a checkout may have recreated it
+                if conn is None or time.time() < holder.expires_at:
+                    continue
+                holder.conn = None
+            # Close outside the lock so a slow close never blocks a checkout
+            _close_quietly(conn)
+            logger.info("Swept expired pooled connection for user=%s, db=%s", key[0], key[1])
+
+
+_sweeper_thread = Thread(
+    target=_sweep_expired_connections, name="duckdb-oh-pool-sweeper", daemon=True
+)
+_sweeper_thread.start()
+
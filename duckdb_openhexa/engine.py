@@ -14,9 +14,9 @@ logger = logging.getLogger(__name__)
 class DuckDBPlusEngineSpec(DuckDBEngineSpec):
     """
     Minimal custom DuckDB engine spec for the duckdb_oh:// dialect.
-    
-    Per-user connection pooling is handled by connection_pool.py patching
-    duckdb_engine.Dialect.connect(), so this class only needs to:
+
+    Per-user connection pooling is handled by DuckDBOpenHexaDialect in
+    dialect.py (registered for duckdb_oh:// URIs), so this class only needs to:
     1. Define the engine name/dialect
     2. Inherit all functionality from DuckDBEngineSpec
     
@@ -1,25 +1,34 @@
 """DuckDB table functions for GraphQL queries."""
 
-import pandas as pd
-from typing import Optional
+import pyarrow as pa
+from typing import Dict, Optional
 
 from duckdb_openhexa.client import OpenHexaGraphQLClient
 
-# Schema for empty DataFrame (must match GraphQL query results)
-_EMPTY_SCHEMA = ["workspace", "dataset", "version", "filename", "file_path"]
+# Explicit Arrow schema (must match GraphQL query results)
+# Pre-declaring it skips per-call type inference and DuckDB scans Arrow zero-copy
+_SCHEMA = pa.schema(
+    [
+        ("workspace", pa.string()),
+        ("dataset", pa.string()),
+        ("version", pa.string()),
+        ("filename", pa.string()),
+        ("file_path", pa.string()),
+    ]
+)
 
 # Global GraphQL client instance (shared across all function calls)
 # This avoids creating a new client for each query while still benefiting from module-level cache
 _graphql_client = OpenHexaGraphQLClient()
 
 
-def openhexa_dataset_files(workspace: Optional[str] = None) -> pd.DataFrame:
+def openhexa_dataset_files(workspace: Optional[str] = None) -> pa.Table:
     """Query datasets from OpenHexa GraphQL API, optionally filtered by workspace."""
     # Use global GraphQL client instance
     datasets = _graphql_client.query_datasets(workspace=workspace)
 
-    # Return DataFrame with consistent schema
-    return pd.DataFrame(datasets) if datasets else pd.DataFrame(columns=_EMPTY_SCHEMA)
+    # Return Arrow table with consistent schema
+    return pa.Table.from_pylist(datasets, schema=_SCHEMA) if datasets else _SCHEMA.empty_table()
 
 
 def get_dataset_file_url(file_path: str) -> Optional[str]:
@@ -30,3 +39,28 @@ def get_dataset_file_url(file_path: str) -> Optional[str]:
     """
     # Use global GraphQL client instance (with global cache)
     return _graphql_client.query_file_download_url(file_path)
+
+
+def get_dataset_file_url_batch(file_paths: pa.ChunkedArray) -> pa.Array:
+    """Vectorized variant of get_dataset_file_url for DuckDB's Arrow UDF interface.
+
+    DuckDB hands over a whole vector of paths (up to 2048 rows) per call; the
+    uncached ones are fetched concurrently so network latency overlaps across
+    the chunk instead of paying one sequential round-trip per row.
+    """
+    paths = file_paths.to_pylist()
+
+    # Fetch each distinct path once: when the URL is projected per row the same
+    # path repeats across the vector, and deduplicating here avoids issuing
+    # (and racing) duplicate GraphQL requests for it within one chunk
+    unique_paths = list(dict.fromkeys(path for path in paths if path is not None))
+
+    urls_by_path: Dict[str, Optional[str]] = {}
+    if unique_paths:
+        results = _graphql_client.query_file_download_urls(unique_paths)
+        urls_by_path = dict(zip(unique_paths, results))
+
+    return pa.array(
+        [None if path is None else urls_by_path[path] for path in paths],
+        type=pa.string(),
+    )
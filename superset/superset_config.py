@@ -7,10 +7,10 @@ if '/app' not in sys.path:
     sys.path.insert(0, '/app')
 
 # Import our custom connector - this does everything:
-# - Registers duckdb_oh:// dialect with SQLAlchemy
-# - Monkey-patches duckdb.connect() for per-user connection pooling
+# - Registers duckdb_oh:// dialect with SQLAlchemy (per-user connection pooling)
 # - Auto-registers UDFs (get_dataset_file_url, openhexa_dataset_files)
 # - Enables HTTP request caching
+# Standard duckdb:// connections are left untouched - there is no monkey-patching.
 import duckdb_openhexa  # noqa: F401
 
 # Allow DuckDB connections
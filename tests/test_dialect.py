@@ -0,0 +1,27 @@
+"""Regression tests for the pooled connection wrapper."""
+
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+pytest.importorskip("duckdb_engine")
+pytest.importorskip("gql")
+pytest.importorskip("pyarrow")
+
+from duckdb_openhexa.dialect import PooledConnectionWrapper
+
+
+def test_close_releases_cursor_but_keeps_root_usable(tmp_path):
+    """close() must really close the checkout's cursor while the pooled root stays alive."""
+    root = duckdb.connect(str(tmp_path / "test.duckdb"))
+    cursor = root.cursor()
+    wrapper = PooledConnectionWrapper(cursor, ("alice", "test.duckdb"))
+
+    wrapper.close()
+
+    assert wrapper.closed
+    # The cursor is gone...
+    with pytest.raises(duckdb.Error):
+        cursor.execute("SELECT 1")
+    # ...but the root connection keeps serving queries for the pool
+    assert root.execute("SELECT 1").fetchone() == (1,)
+    root.close()